@@ -23,7 +23,13 @@ CERTBOT_LOG_DIR = "/var/log/letsencrypt"
 # DNS Verification
 DNS_SERVERS = ["8.8.8.8", "8.8.4.4", "1.1.1.1", "1.0.0.1"]
 DNS_TIMEOUT = 30
+DNS_SERVER_TIMEOUT = 3     # Per-server lifetime when DNS_SERVERS are queried concurrently
+DNS_FAST_PATH = True       # verify-dns: raw UDP A query to DNS_SERVERS[0], dnspython as fallback
 DNS_RETRIES = 3
+DNS_CACHE_SIZE = 2048      # Resolver answer cache entries (env DNS_CACHE_SIZE overrides)
+VERIFY_DNS_CACHE_DIR = "~/.cache/verify-dns"
+DNS_PROVIDER_CACHE_TTL = 3600   # Seconds a detected DNS provider is reused
+CLOUDFLARE_CIDR_CACHE_TTL = 86400   # Seconds the fetched Cloudflare IP ranges are reused
 
 # Logging
 LOG_LEVEL = "INFO"        # DEBUG, INFO, WARNING, ERROR
@@ -50,6 +56,9 @@ RATE_LIMIT_ENABLED = False
 RATE_LIMIT_ZONE = "custom_domain"
 RATE_LIMIT_RATE = "10r/s"
 
+# Cache directory (parsed certificate expiry dates)
+CACHE_DIR = "/var/cache/domain-manager"
+
 # Backup Configuration
 BACKUP_ENABLED = True
 BACKUP_DIR = "/var/backups/domain-configs"
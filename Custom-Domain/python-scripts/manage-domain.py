@@ -1,32 +1,25 @@
 #!/usr/bin/env python3
 import argparse
+import asyncio
+import atexit
+import fcntl
 import ipaddress
 import json
 import os
-import re
 import shutil
+import stat
+import string
 import subprocess
 import sys
-from datetime import datetime
+import time
+from functools import lru_cache
 from pathlib import Path
 
-# Optional: dnspython for DNS verify in "check"
-try:
-    import dns.resolver
-except Exception:
-    dns = None
-
-# Optional: cryptography to read cert expiry in "check"
-try:
-    from cryptography import x509
-    from cryptography.hazmat.backends import default_backend
-except Exception:
-    x509 = None
-
 import config
 
 SCRIPT_DIR = Path(__file__).resolve().parent
 LOG_FILE = Path(config.LOG_FILE)
+CERT_EXPIRY_CACHE = Path(config.CACHE_DIR)/"cert_expiry.json"
 
 ANSI = {
     "RED": "\033[0;31m",
@@ -36,16 +29,68 @@ ANSI = {
     "NC": "\033[0m",
 }
 
+# Optional dependencies, only needed by "check"; imported on first use so
+# list/request/delete/renew (and the daily cron renew) don't pay for them.
+_UNLOADED = object()
+_dns = _UNLOADED    # dnspython for DNS verify
+_x509 = _UNLOADED   # cryptography to read cert expiry
+
+def _import_dns():
+    global _dns
+    if _dns is _UNLOADED:
+        try:
+            import dns.asyncresolver
+            import dns.resolver
+            _dns = dns
+        except Exception:
+            _dns = None
+    return _dns
+
+def _import_x509():
+    global _x509
+    if _x509 is _UNLOADED:
+        try:
+            from cryptography import x509
+            _x509 = x509
+        except Exception:
+            _x509 = None
+    return _x509
+
+# Directories already created/confirmed during this run
+_KNOWN_DIRS = set()
+
+def _ensure_dir(p: Path):
+    if str(p) not in _KNOWN_DIRS:
+        p.mkdir(parents=True, exist_ok=True)
+        _KNOWN_DIRS.add(str(p))
+
+_LAST_TS = (0, "")  # (epoch second, formatted string); one tuple so updates are atomic
+
 def _ts():
-    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    global _LAST_TS
+    now = time.time()
+    sec = int(now)
+    if sec != _LAST_TS[0]:
+        _LAST_TS = (sec, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now)))
+    return _LAST_TS[1]
+
+_LOG_FH = None
+
+def _get_log_fh():
+    # Opened once per run; line-buffered so every entry still hits the file.
+    global _LOG_FH
+    if _LOG_FH is None:
+        _ensure_dir(LOG_FILE.parent)
+        _LOG_FH = LOG_FILE.open("a", buffering=1)
+        atexit.register(_LOG_FH.close)
+    return _LOG_FH
 
 def log(msg, color="BLUE"):
-    line = f'{ANSI.get(color,"")}[{_ts()}]{ANSI["NC"]} {msg}'
+    ts = _ts()
+    line = f'{ANSI.get(color,"")}[{ts}]{ANSI["NC"]} {msg}'
     print(line)
     try:
-        LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
-        with LOG_FILE.open("a") as f:
-            f.write(f"[{_ts()}] {msg}\n")
+        _get_log_fh().write(f"[{ts}] {msg}\n")
     except Exception:
         pass
 
@@ -58,8 +103,12 @@ def require_root():
         error("This script must be run as root (use sudo)")
         sys.exit(1)
 
+# PATH lookups and existence checks are memoized for the run
+_which = lru_cache(maxsize=32)(shutil.which)
+_path_exists = lru_cache(maxsize=64)(lambda p: Path(p).exists())
+
 def which_or_die(path, hint):
-    if shutil.which(path) is None and not Path(path).exists():
+    if _which(path) is None and not _path_exists(path):
         error(f"{path} not found. {hint}")
         sys.exit(1)
 
@@ -67,7 +116,7 @@ def check_dependencies():
     log("Checking dependencies...")
     which_or_die(config.CERTBOT_PATH, "Install: apt-get install certbot python3-certbot-nginx")
     which_or_die("/usr/sbin/nginx", "Install: apt-get install nginx")
-    if shutil.which("dig") is None:
+    if _which("dig") is None:
         warning("dig not found. DNS checks will use dnspython only (recommended). Install bind9-utils for parity.")
     success("All dependencies are available (or reasonable fallbacks present)")
 
@@ -86,23 +135,43 @@ def load_env_overrides():
                     try: val = int(val)
                     except: pass
                 setattr(config, name, val)
+    _nginx_static_subs.cache_clear()
 
-DOMAIN_RE = re.compile(r"^[A-Za-z0-9]([A-Za-z0-9\-]{0,61}[A-Za-z0-9])?(\.[A-Za-z0-9]([A-Za-z0-9\-]{0,61}[A-Za-z0-9])?)*$")
+_LABEL_CHARS = frozenset(string.ascii_letters + string.digits + "-")
+
+def _is_valid_domain(domain: str) -> bool:
+    # Single linear pass over the labels: 1-63 chars of [A-Za-z0-9-],
+    # not starting or ending with a hyphen, 253 chars max overall.
+    if not domain or len(domain) > 253:
+        return False
+    for label in domain.split("."):
+        if not 1 <= len(label) <= 63 or label[0] == "-" or label[-1] == "-":
+            return False
+        if not _LABEL_CHARS.issuperset(label):
+            return False
+    return True
 
 def validate_domain(domain: str) -> bool:
-    if not DOMAIN_RE.match(domain):
+    if not _is_valid_domain(domain):
         error(f"Invalid domain format: {domain}")
         return False
     return True
 
+def _nginx_test_start():
+    # Launches `nginx -t` without waiting, so callers can overlap it with other work.
+    return subprocess.Popen(["/usr/sbin/nginx","-t"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+
+def _nginx_test_finish(proc) -> bool:
+    out, _ = proc.communicate()
+    log(out.strip())
+    return proc.returncode == 0
+
 def nginx_test() -> bool:
-    res = subprocess.run(["/usr/sbin/nginx","-t"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-    log(res.stdout.strip())
-    return res.returncode == 0
+    return _nginx_test_finish(_nginx_test_start())
 
 def nginx_reload() -> bool:
     log("Reloading Nginx...")
-    res = subprocess.run(["systemctl","reload","nginx"])
+    res = subprocess.run(["systemctl","reload","nginx"], stdout=subprocess.DEVNULL, check=False)
     if res.returncode == 0:
         success("Nginx reloaded successfully")
         return True
@@ -112,9 +181,49 @@ def nginx_reload() -> bool:
 def certificate_path(domain: str) -> Path:
     return Path("/etc/letsencrypt/live")/domain/"cert.pem"
 
+def _cached_cert_expiry(cert_file: Path, mtime_ns: int):
+    try:
+        with CERT_EXPIRY_CACHE.open() as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            entry = json.load(f).get(str(cert_file))
+    except Exception:
+        return None
+    if entry and entry.get("mtime_ns") == mtime_ns:
+        return entry.get("expiry")
+    return None
+
+def _store_cert_expiry(cert_file: Path, mtime_ns: int, expiry: str):
+    # One entry per certificate path, replaced when certbot renews it
+    try:
+        _ensure_dir(CERT_EXPIRY_CACHE.parent)
+        with CERT_EXPIRY_CACHE.open("a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                data = json.load(f)
+            except ValueError:
+                data = {}
+            data[str(cert_file)] = {"mtime_ns": mtime_ns, "expiry": expiry}
+            f.seek(0)
+            f.truncate()
+            json.dump(data, f)
+    except Exception:
+        pass
+
 def read_cert_expiry(cert_file: Path) -> str:
-    if not cert_file.exists():
+    try:
+        mtime_ns = cert_file.stat().st_mtime_ns
+    except FileNotFoundError:
         return "not found"
+    expiry = _cached_cert_expiry(cert_file, mtime_ns)
+    if expiry is None:
+        expiry = _parse_cert_expiry(cert_file)
+        if expiry != "unknown":
+            _store_cert_expiry(cert_file, mtime_ns, expiry)
+    return expiry
+
+def _parse_cert_expiry(cert_file: Path) -> str:
+    x509 = _import_x509()
     if x509 is None:
         # fallback via openssl
         try:
@@ -123,6 +232,7 @@ def read_cert_expiry(cert_file: Path) -> str:
         except Exception:
             return "unknown"
     try:
+        from cryptography.hazmat.backends import default_backend
         data = cert_file.read_bytes()
         cert = x509.load_pem_x509_certificate(data, default_backend())
         return cert.not_valid_after.strftime("%Y-%m-%d %H:%M:%S %Z")
@@ -143,22 +253,73 @@ def request_certificate(domain: str, email: str) -> bool:
     if config.FORCE_RENEWAL:
         args.append("--force-renewal")
         log("Forcing certificate renewal")
-    res = subprocess.run(args)
+    res = subprocess.run(args, check=False)
     if res.returncode == 0:
         success(f"SSL certificate obtained successfully for {domain}")
         return True
     error(f"Failed to obtain SSL certificate for {domain}")
     return False
 
-def _nginx_server_block(domain: str) -> str:
-    # Build the nginx config from Python, keeping your original hardening/settings.
-    headers = [
-        'add_header X-Frame-Options DENY;',
-        'add_header X-Content-Type-Options nosniff;',
-        'add_header X-XSS-Protection "1; mode=block";',
-        'add_header Strict-Transport-Security "max-age=31536000; includeSubDomains" always;',
-    ]
-    websocket = f"""
+# Hardening shared by every domain; derived from config settings that can't be
+# overridden from the environment, so they are fixed at import time.
+_STATIC_SSL_BLOCK = f"""ssl_protocols {config.SSL_PROTOCOLS};
+    ssl_ciphers {config.SSL_CIPHERS};
+    ssl_prefer_server_ciphers off;
+    ssl_session_cache {config.SSL_SESSION_CACHE};
+    ssl_session_timeout {config.SSL_SESSION_TIMEOUT};"""
+
+_STATIC_HEADERS = "\n    ".join([
+    'add_header X-Frame-Options DENY;',
+    'add_header X-Content-Type-Options nosniff;',
+    'add_header X-XSS-Protection "1; mode=block";',
+    'add_header Strict-Transport-Security "max-age=31536000; includeSubDomains" always;',
+])
+
+# Server block template, parsed once; "$$" escapes nginx's own variables.
+_NGINX_TEMPLATE = string.Template("""# Custom domain configuration for $domain
+server {
+    listen 80;
+    server_name $domain www.$domain;
+
+    return 301 https://$$server_name$$request_uri;
+}
+
+server {
+    listen 443 ssl http2;
+    server_name $domain www.$domain;
+$rate_block
+    ssl_certificate /etc/letsencrypt/live/$domain/fullchain.pem;
+    ssl_certificate_key /etc/letsencrypt/live/$domain/privkey.pem;
+
+    $ssl_block
+
+    $headers
+
+    location / {
+        proxy_pass http://$backend;
+        proxy_set_header Host $$host;
+        proxy_set_header X-Real-IP $$remote_addr;
+        proxy_set_header X-Forwarded-For $$proxy_add_x_forwarded_for;
+        proxy_set_header X-Forwarded-Proto $$scheme;
+        $websocket_block
+        proxy_connect_timeout 60s;
+        proxy_send_timeout 60s;
+        proxy_read_timeout 60s;
+    }
+
+    location $health_path {
+        access_log off;
+        return 200 "healthy\\n";
+        add_header Content-Type text/plain;
+    }
+}
+""")
+
+@lru_cache(maxsize=1)
+def _nginx_static_subs() -> dict:
+    # Everything except the domain is fixed for a run; computed once, after
+    # load_env_overrides() (which clears this cache).
+    websocket = """
         proxy_http_version 1.1;
         proxy_set_header Upgrade $http_upgrade;
         proxy_set_header Connection "upgrade";
@@ -171,95 +332,87 @@ def _nginx_server_block(domain: str) -> str:
     limit_req_zone $binary_remote_addr zone={config.RATE_LIMIT_ZONE}:10m rate={config.RATE_LIMIT_RATE};
     """
 
-    return f"""# Custom domain configuration for {domain}
-server {{
-    listen 80;
-    server_name {domain} www.{domain};
-
-    return 301 https://$server_name$request_uri;
-}}
-
-server {{
-    listen 443 ssl http2;
-    server_name {domain} www.{domain};
-{rate}
-    ssl_certificate /etc/letsencrypt/live/{domain}/fullchain.pem;
-    ssl_certificate_key /etc/letsencrypt/live/{domain}/privkey.pem;
-
-    ssl_protocols {config.SSL_PROTOCOLS};
-    ssl_ciphers {config.SSL_CIPHERS};
-    ssl_prefer_server_ciphers off;
-    ssl_session_cache {config.SSL_SESSION_CACHE};
-    ssl_session_timeout {config.SSL_SESSION_TIMEOUT};
-
-    {headers[0]}
-    {headers[1]}
-    {headers[2]}
-    {headers[3]}
-
-    location / {{
-        proxy_pass http://{config.BACKEND_APP_HOST}:{config.BACKEND_APP_PORT};
-        proxy_set_header Host $host;
-        proxy_set_header X-Real-IP $remote_addr;
-        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
-        proxy_set_header X-Forwarded-Proto $scheme;
-        {websocket}
-        proxy_connect_timeout 60s;
-        proxy_send_timeout 60s;
-        proxy_read_timeout 60s;
-    }}
+    return {
+        "rate_block": rate,
+        "websocket_block": websocket,
+        "headers": _STATIC_HEADERS,
+        "ssl_block": _STATIC_SSL_BLOCK,
+        "backend": f"{config.BACKEND_APP_HOST}:{config.BACKEND_APP_PORT}",
+        "health_path": config.HEALTH_CHECK_PATH,
+    }
 
-    location {config.HEALTH_CHECK_PATH} {{
-        access_log off;
-        return 200 "healthy\\n";
-        add_header Content-Type text/plain;
-    }}
-}}
-"""
+def _nginx_server_block(domain: str) -> str:
+    # Build the nginx config from Python, keeping your original hardening/settings.
+    return _NGINX_TEMPLATE.substitute(_nginx_static_subs(), domain=domain)
 
 def create_nginx_config(domain: str) -> Path:
     target = Path(config.NGINX_SITES_AVAILABLE)/domain
     log(f"Creating Nginx configuration for {domain}: {target}")
-    target.parent.mkdir(parents=True, exist_ok=True)
+    _ensure_dir(target.parent)
     content = _nginx_server_block(domain)
     target.write_text(content)
     success(f"Nginx configuration created: {target}")
     return target
 
+def _link_status(p: Path) -> str:
+    # one lstat instead of is_symlink() + exists()
+    try:
+        st = os.lstat(p)
+    except FileNotFoundError:
+        return "absent"
+    return "symlink" if stat.S_ISLNK(st.st_mode) else "file"
+
 def enable_nginx_site(domain: str):
     src = Path(config.NGINX_SITES_AVAILABLE)/domain
     dst = Path(config.NGINX_SITES_ENABLED)/domain
     if not src.exists():
         error(f"Nginx configuration file not found: {src}")
         return False
-    dst.parent.mkdir(parents=True, exist_ok=True)
-    if dst.is_symlink() or dst.exists():
+    _ensure_dir(dst.parent)
+    if _link_status(dst) != "absent":
+        log(f"Site already enabled: {domain}")
+        return True
+    try:
+        dst.symlink_to(src)
+    except FileExistsError:
         log(f"Site already enabled: {domain}")
         return True
-    dst.symlink_to(src)
     success(f"Nginx site enabled: {domain}")
     return True
 
 def check_domain_exists(domain: str) -> bool:
     return (Path(config.NGINX_SITES_AVAILABLE)/domain).exists() or (Path(config.NGINX_SITES_ENABLED)/domain).exists()
 
+async def _resolve_all(dns, domain: str) -> set:
+    # One resolver per configured server, queried concurrently, so a dead
+    # server costs its own timeout instead of delaying the others.
+    resolvers = []
+    for ns in config.DNS_SERVERS or [None]:
+        resolver = dns.asyncresolver.Resolver(configure=ns is None)  # resolv.conf only as the fallback
+        resolver.timeout = config.DNS_SERVER_TIMEOUT
+        resolver.lifetime = config.DNS_SERVER_TIMEOUT
+        if ns:
+            resolver.nameservers = [ns]
+        resolvers.append(resolver)
+    results = await asyncio.gather(*[r.resolve(domain, "A") for r in resolvers], return_exceptions=True)
+    resolved = set()
+    for answers in results:
+        if isinstance(answers, BaseException):
+            continue
+        for r in answers:
+            resolved.add(r.to_text())
+    return resolved
+
 def verify_dns(domain: str, expected_ips):
     """
     Pythonic DNS verification using dnspython (preferred).
     Falls back to 'dig' if dnspython isn't installed.
     """
     resolved = set()
+    dns = _import_dns()
     if dns is not None:
-        resolver = dns.resolver.Resolver()
-        resolver.timeout = config.DNS_TIMEOUT
-        resolver.lifetime = config.DNS_TIMEOUT
-        # try multiple DNS servers if provided
-        if config.DNS_SERVERS:
-            resolver.nameservers = config.DNS_SERVERS
         try:
-            answers = resolver.resolve(domain, "A")
-            for r in answers:
-                resolved.add(r.to_text())
+            resolved = asyncio.run(_resolve_all(dns, domain))
         except Exception:
             pass
     if not resolved:
@@ -268,8 +421,11 @@ def verify_dns(domain: str, expected_ips):
             out = subprocess.check_output(["dig","+short",domain,"A"], text=True)
             for line in out.splitlines():
                 line=line.strip()
-                if re.match(r"^\d+\.\d+\.\d+\.\d+$", line):
-                    resolved.add(line)
+                try:
+                    ipaddress.IPv4Address(line)
+                except ValueError:
+                    continue
+                resolved.add(line)
         except Exception:
             pass
     if not resolved:
@@ -282,20 +438,23 @@ def verify_dns(domain: str, expected_ips):
     return any(ip in resolved for ip in expected_ips)
 
 def list_domains():
-    base = Path(config.NGINX_SITES_AVAILABLE)
-    if not base.exists():
+    base = config.NGINX_SITES_AVAILABLE
+    if not os.path.isdir(base):
         print("  (none)")
         return
-    for p in sorted(base.iterdir()):
-        if p.is_file():
-            print(f"  - {p.name}")
-
-def delete_domain(domain: str):
+    # DirEntry.is_file() uses the type from readdir, no stat per entry
+    # (only symlinks are followed, same as Path.is_file())
+    with os.scandir(base) as it:
+        for entry in sorted(it, key=lambda e: e.name):
+            if entry.is_file():
+                print(f"  - {entry.name}")
+
+def _remove_nginx_site(domain: str) -> bool:
     ok = True
     en = Path(config.NGINX_SITES_ENABLED)/domain
     av = Path(config.NGINX_SITES_AVAILABLE)/domain
 
-    if en.is_symlink() or en.exists():
+    if _link_status(en) != "absent":
         try:
             en.unlink()
             success(f"Nginx site disabled: {domain}")
@@ -305,7 +464,7 @@ def delete_domain(domain: str):
     else:
         log(f"Nginx site not enabled for: {domain}")
 
-    if av.exists():
+    if _link_status(av) != "absent":
         try:
             av.unlink()
             success(f"Nginx configuration removed: {domain}")
@@ -314,28 +473,45 @@ def delete_domain(domain: str):
             error(f"Failed to remove Nginx configuration: {domain} ({e})")
     else:
         log(f"Nginx configuration not found for: {domain}")
+    return ok
 
+def _delete_certificate(domain: str):
     # Revoke & delete cert via certbot (safe if already gone)
     live_dir = Path("/etc/letsencrypt/live")/domain
-    if live_dir.exists():
-        log(f"Revoking SSL certificate for {domain}")
-        subprocess.run([config.CERTBOT_PATH, "revoke", "--cert-path", str(live_dir/"cert.pem"), "--non-interactive"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if not live_dir.exists():
+        log(f"SSL certificate not found for: {domain}")
+        return
+    log(f"Revoking and deleting SSL certificate for {domain}")
+    # one certbot process does both steps; certbot only takes one --cert-name per delete
+    res = subprocess.run([config.CERTBOT_PATH, "revoke", "--cert-path", str(live_dir/"cert.pem"), "--delete-after-revoke", "--non-interactive"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+    if res.returncode != 0:
+        # revocation failed (e.g. staging cert); still remove the files
         log(f"Deleting certificate files for {domain}")
         subprocess.run([config.CERTBOT_PATH, "delete", "--cert-name", domain, "--non-interactive"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    else:
-        log(f"SSL certificate not found for: {domain}")
 
-    if nginx_test():
+def delete_domains(domains):
+    ok = True
+    for domain in domains:
+        ok = _remove_nginx_site(domain) and ok
+
+    # certbot only touches /etc/letsencrypt, so test the nginx config meanwhile;
+    # test and reload once for the whole batch
+    nginx_check = _nginx_test_start()
+    for domain in domains:
+        _delete_certificate(domain)
+
+    names = ", ".join(domains)
+    if _nginx_test_finish(nginx_check):
         if nginx_reload():
             if ok:
-                success(f"Domain {domain} deleted successfully")
+                success(f"Domain {names} deleted successfully")
             else:
-                warning(f"Domain {domain} partially deleted (some operations failed)")
+                warning(f"Domain {names} partially deleted (some operations failed)")
         else:
-            error(f"Failed to reload Nginx after deleting {domain}")
+            error(f"Failed to reload Nginx after deleting {names}")
             sys.exit(1)
     else:
-        error("Nginx configuration is invalid after deleting {domain}")
+        error(f"Nginx configuration is invalid after deleting {names}")
         sys.exit(1)
 
 def main():
@@ -349,7 +525,7 @@ def main():
 Examples:
   manage_domain.py request example.com admin@example.com
   manage_domain.py check example.com 203.0.113.10 203.0.113.20
-  manage_domain.py delete example.com
+  manage_domain.py delete example.com www.example.org
   manage_domain.py renew
   manage_domain.py list
         """,
@@ -366,7 +542,7 @@ Examples:
     p_check.add_argument("expected_ips", nargs="*")
 
     p_del = sub.add_parser("delete", help="Delete domain configuration and certificate")
-    p_del.add_argument("domain")
+    p_del.add_argument("domains", nargs="+")
 
     sub.add_parser("renew", help="Renew all certificates")
     sub.add_parser("list", help="List configured domains")
@@ -374,9 +550,9 @@ Examples:
     args = parser.parse_args()
 
     if args.action in {"request","check","delete"}:
-        domain = args.domain
-        if not validate_domain(domain):
-            sys.exit(1)
+        for domain in getattr(args, "domains", None) or [args.domain]:
+            if not validate_domain(domain):
+                sys.exit(1)
 
     if args.action == "request":
         if check_domain_exists(args.domain):
@@ -422,11 +598,11 @@ Examples:
                 sys.exit(1)
 
     elif args.action == "delete":
-        delete_domain(args.domain)
+        delete_domains(args.domains)
 
     elif args.action == "renew":
         log("Renewing certificates...")
-        res = subprocess.run([config.CERTBOT_PATH, "renew", "--quiet"])
+        res = subprocess.run([config.CERTBOT_PATH, "renew", "--quiet"], check=False)
         if res.returncode == 0:
             success("All certificates renewed successfully")
             nginx_reload()
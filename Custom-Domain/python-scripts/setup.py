@@ -1,12 +1,15 @@
 #!/usr/bin/env python3
+import atexit
 import os
 import platform
 import re
 import shutil
 import subprocess
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from datetime import datetime
+from functools import lru_cache
 
 import config
 
@@ -22,14 +25,34 @@ ANSI = {
     "NC": "\033[0m",
 }
 
+# PATH lookups are memoized; only used once packages are installed
+_which = lru_cache(maxsize=32)(shutil.which)
+
+_LAST_TS = (0, "")  # (epoch second, formatted string); one tuple so updates are atomic
+
 def _ts():
-    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    global _LAST_TS
+    now = time.time()
+    sec = int(now)
+    if sec != _LAST_TS[0]:
+        _LAST_TS = (sec, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now)))
+    return _LAST_TS[1]
+
+_LOG_FH = None
+
+def _get_log_fh():
+    # Opened once per run; line-buffered so every entry still hits the file.
+    global _LOG_FH
+    if _LOG_FH is None:
+        _LOG_FH = LOG_FILE.open("a", buffering=1)
+        atexit.register(_LOG_FH.close)
+    return _LOG_FH
 
 def log(msg, color="BLUE"):
-    line = f'{ANSI.get(color,"")}[{_ts()}]{ANSI["NC"]} {msg}'
+    ts = _ts()
+    line = f'{ANSI.get(color,"")}[{ts}]{ANSI["NC"]} {msg}'
     print(line)
-    with LOG_FILE.open("a") as f:
-        f.write(f"[{_ts()}] {msg}\n")
+    _get_log_fh().write(f"[{ts}] {msg}\n")
 
 def success(msg): log(f"[SUCCESS] {msg}", "GREEN")
 def warning(msg): log(f"[WARNING] {msg}", "YELLOW")
@@ -43,11 +66,12 @@ def require_root():
 def detect_os():
     os_name, os_ver = "", ""
     try:
-        content = Path("/etc/os-release").read_text()
-        m_name = re.search(r'^NAME="?(.*?)"?$', content, re.M|re.I)
-        m_ver  = re.search(r'^VERSION_ID="?(.*?)"?$', content, re.M|re.I)
-        if m_name: os_name = m_name.group(1)
-        if m_ver:  os_ver  = m_ver.group(1)
+        data = {}
+        for line in Path("/etc/os-release").read_text().splitlines():
+            if "=" in line:
+                k, v = line.split("=", 1)
+                data[k.strip().upper()] = v.strip().strip('"')
+        os_name, os_ver = data.get("NAME", ""), data.get("VERSION_ID", "")
     except Exception:
         os_name = platform.system()
         os_ver = platform.release()
@@ -73,67 +97,56 @@ def update_packages(os_name):
         error("Failed to update packages")
         sys.exit(1)
 
-def install_basic_deps(os_name):
-    log("Installing basic dependencies...")
+REQUIRED_PKGS = {"nginx", "certbot", "python3-certbot-nginx"}
+
+def _package_plan(os_name, os_ver):
+    if "Ubuntu" in os_name or "Debian" in os_name:
+        return ["apt-get","install","-y"], [
+            "curl","wget","git","unzip","software-properties-common",
+            "nginx","certbot","python3-certbot-nginx","bind9-utils","jq",
+        ]
+    pkgs = ["curl","wget","git","unzip","nginx","bind-utils","jq"]
+    if "Amazon Linux" in os_name and os_ver.strip() == "2":
+        # certbot comes from pip on Amazon Linux 2 (see install_packages)
+        pkgs.append("python3-pip")
+    else:
+        pkgs += ["certbot","python3-certbot-nginx"]
+    return ["yum","install","-y"], pkgs
+
+def install_packages(os_name, os_ver):
+    log("Installing system packages...")
+    cmd, pkgs = _package_plan(os_name, os_ver)
+    if cmd[0] == "yum":
+        # nginx/certbot live in EPEL, so the repo has to be enabled before the batch
+        try:
+            run(cmd + ["epel-release"])
+        except subprocess.CalledProcessError:
+            warning("Failed to install epel-release. Continue if already present.")
     try:
-        if "Ubuntu" in os_name or "Debian" in os_name:
-            run(["apt-get","install","-y","curl","wget","git","unzip","software-properties-common"])
-        elif any(x in os_name for x in ["CentOS","Red Hat","Rocky","AlmaLinux","Amazon Linux"]):
-            run(["yum","install","-y","curl","wget","git","unzip","epel-release"])
-        success("Basic dependencies installed")
+        # one package-manager transaction instead of one per dependency group
+        run(cmd + pkgs)
     except subprocess.CalledProcessError:
-        warning("Failed to install some basic deps. Continue if already present.")
-
-def install_nginx(os_name):
-    log("Installing Nginx...")
+        warning("Batch install failed, retrying packages one by one")
+        failed = []
+        for pkg in pkgs:
+            try:
+                run(cmd + [pkg])
+            except subprocess.CalledProcessError:
+                failed.append(pkg)
+        if failed:
+            warning(f"Could not install: {' '.join(failed)}")
+        if REQUIRED_PKGS & set(failed):
+            error("Nginx/Certbot installation failed")
+            sys.exit(1)
     try:
-        if "Ubuntu" in os_name or "Debian" in os_name:
-            run(["apt-get","install","-y","nginx"])
-        else:
-            run(["yum","install","-y","nginx"])
+        if "python3-pip" in pkgs:
+            run(["pip3","install","certbot","certbot-nginx"])
         run(["systemctl","enable","nginx"])
         run(["systemctl","start","nginx"])
-        success("Nginx installed and started")
-    except subprocess.CalledProcessError:
-        error("Nginx installation failed")
-        sys.exit(1)
-
-def install_certbot(os_name, os_ver):
-    log("Installing Certbot...")
-    try:
-        if "Ubuntu" in os_name or "Debian" in os_name:
-            run(["apt-get","install","-y","certbot","python3-certbot-nginx"])
-        elif "Amazon Linux" in os_name and os_ver.strip() == "2":
-            run(["yum","install","-y","python3-pip"])
-            run(["pip3","install","certbot","certbot-nginx"])
-        else:
-            run(["yum","install","-y","certbot","python3-certbot-nginx"])
-        success("Certbot installed")
     except subprocess.CalledProcessError:
-        error("Certbot installation failed")
+        error("Nginx/Certbot setup failed")
         sys.exit(1)
-
-def install_dns_utils(os_name):
-    log("Installing DNS utilities...")
-    try:
-        if "Ubuntu" in os_name or "Debian" in os_name:
-            run(["apt-get","install","-y","bind9-utils"])
-        else:
-            run(["yum","install","-y","bind-utils"])
-        success("DNS utilities installed")
-    except subprocess.CalledProcessError:
-        warning("Could not install DNS utilities (dig). dnspython will still work.")
-
-def install_jq(os_name):
-    log("Installing jq...")
-    try:
-        if "Ubuntu" in os_name or "Debian" in os_name:
-            run(["apt-get","install","-y","jq"])
-        else:
-            run(["yum","install","-y","jq"])
-        success("jq installed")
-    except subprocess.CalledProcessError:
-        warning("Could not install jq (optional).")
+    success("System packages installed and Nginx started")
 
 def install_nodejs(os_name):
     log("Installing Node.js (optional)...")
@@ -177,26 +190,26 @@ def configure_nginx():
                     nginx_conf.write_text(new)
                     success("Added sites-enabled include via text edit")
     # Test and reload
-    res = subprocess.run(["nginx","-t"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    res = subprocess.run(["nginx","-t"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, check=False)
     log(res.stdout.strip())
     if res.returncode != 0:
         error("Nginx configuration is invalid")
         sys.exit(1)
-    subprocess.run(["systemctl","reload","nginx"], check=False)
+    subprocess.run(["systemctl","reload","nginx"], stdout=subprocess.DEVNULL, check=False)
     success("Nginx configuration valid and reloaded")
 
 def configure_firewall(os_name):
     log("Configuring firewall (if present)...")
-    if shutil.which("ufw"):
-        subprocess.run(["ufw","allow","'Nginx Full'"], shell=False)
-        subprocess.run(["ufw","allow","ssh"])
-        subprocess.run(["ufw","--force","enable"])
+    if _which("ufw"):
+        # ';' not '&&': the 'Nginx Full' profile is missing when nginx isn't the distro package
+        subprocess.run(["sh","-c","ufw allow 'Nginx Full'; ufw allow ssh; ufw --force enable"],
+                       stdout=subprocess.DEVNULL, check=False)
         success("UFW configured")
-    elif shutil.which("firewall-cmd"):
-        subprocess.run(["firewall-cmd","--permanent","--add-service=http"])
-        subprocess.run(["firewall-cmd","--permanent","--add-service=https"])
-        subprocess.run(["firewall-cmd","--permanent","--add-service=ssh"])
-        subprocess.run(["firewall-cmd","--reload"])
+    elif _which("firewall-cmd"):
+        # firewall-cmd accepts several --add-service flags in one call
+        subprocess.run(["sh","-c",
+            "firewall-cmd --permanent --add-service=http --add-service=https --add-service=ssh"
+            "; firewall-cmd --reload"], stdout=subprocess.DEVNULL, check=False)
         success("firewalld configured")
     else:
         warning("No known firewall tool detected; skipping")
@@ -220,23 +233,36 @@ RestartSec=5
 WantedBy=multi-user.target
 """
     Path("/etc/systemd/system/domain-manager.service").write_text(unit)
-    subprocess.run(["systemctl","daemon-reload"])
-    subprocess.run(["systemctl","enable","domain-manager.service"])
+    subprocess.run(["sh","-c","systemctl daemon-reload && systemctl enable domain-manager.service"],
+                   stdout=subprocess.DEVNULL, check=False)
     success("Systemd service created and enabled")
 
 def create_cron_job():
     log("Creating cron job for cert renewal...")
-    cron_line = f"0 12 * * * /usr/bin/env python3 {SCRIPT_DIR}/manage_domain.py renew >> {SCRIPT_DIR}/cron.log 2>&1"
+    # /etc/cron.d entries need the user column; cron picks the file up by itself
+    cron_file = Path("/etc/cron.d/domain-manager")
     try:
-        existing = subprocess.run(["crontab","-l"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
-        lines = existing.stdout.splitlines() if existing.returncode == 0 else []
-        if cron_line not in lines:
-            lines.append(cron_line)
-            p = subprocess.run(["crontab","-"], input="\n".join(lines)+"\n", text=True)
-            if p.returncode == 0:
-                success("Cron job created for daily certificate renewal at 12:00 PM")
+        cron_file.write_text(f"0 12 * * * root /usr/bin/env python3 {SCRIPT_DIR}/manage_domain.py renew >> {SCRIPT_DIR}/cron.log 2>&1\n")
+        os.chmod(cron_file, 0o644)
+        success("Cron job created for daily certificate renewal at 12:00 PM")
     except Exception as e:
         warning(f"Failed to create cron job: {e}")
+        return
+    # Older setups put the same job in root's crontab; drop it so renew doesn't run twice
+    if not _which("crontab"):
+        return
+    existing = subprocess.run(["crontab","-l"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=False)
+    if existing.returncode != 0:
+        return
+    lines = existing.stdout.splitlines()
+    legacy = f"{SCRIPT_DIR}/manage_domain.py renew"
+    kept = [l for l in lines if legacy not in l]
+    if len(kept) != len(lines):
+        p = subprocess.run(["crontab","-"], input="".join(l+"\n" for l in kept), text=True, check=False)
+        if p.returncode == 0:
+            log("Removed legacy renewal entry from root crontab")
+        else:
+            warning("Legacy renewal entry still in root crontab; remove it to avoid duplicate runs")
 
 def setup_log_rotation():
     log("Setting up log rotation...")
@@ -271,17 +297,17 @@ def set_permissions():
 
 def test_installation():
     log("Testing installation...")
-    if subprocess.run(["systemctl","is-active","--quiet","nginx"]).returncode == 0:
+    if subprocess.run(["systemctl","is-active","--quiet","nginx"], check=False).returncode == 0:
         success("Nginx is running")
     else:
         error("Nginx is not running")
         sys.exit(1)
-    if shutil.which("certbot"):
+    if _which("certbot"):
         success("Certbot is available")
     else:
         error("Certbot is not available")
         sys.exit(1)
-    if shutil.which("dig") or True:
+    if _which("dig") or True:
         success("DNS utilities/dnspython are available")
     else:
         error("DNS tools are not available")
@@ -322,19 +348,16 @@ def main():
     require_root()
     os_name, os_ver = detect_os()
     update_packages(os_name)
-    install_basic_deps(os_name)
-    install_nginx(os_name)
-    install_certbot(os_name, os_ver)
-    install_dns_utils(os_name)
-    install_jq(os_name)
+    install_packages(os_name, os_ver)
     install_nodejs(os_name)
     configure_nginx()
     configure_firewall(os_name)
-    create_systemd_service()
-    create_cron_job()
-    setup_log_rotation()
-    create_backup_dir()
-    set_permissions()
+    # these touch disjoint paths (systemd unit, cron.d, logrotate, backup dir, scripts)
+    with ThreadPoolExecutor(max_workers=4) as ex:
+        futures = [ex.submit(f) for f in (create_systemd_service, create_cron_job,
+                                          setup_log_rotation, create_backup_dir, set_permissions)]
+        for f in futures:
+            f.result()
     test_installation()
     post_install_note()
     success("Installation completed successfully!")
@@ -1,18 +1,72 @@
 #!/usr/bin/env python3
 import argparse
+import asyncio
+import atexit
+import fcntl
 import ipaddress
 import json
+import os
+import random
+import socket
+import struct
 import sys
+import time
 import urllib.request
 from pathlib import Path
-from datetime import datetime
 
 import config
 
 # dnspython
+import dns.asyncresolver
+import dns.exception
+import dns.message
 import dns.resolver
 
+# Optional: faster JSON parsing for the Cloudflare API payload
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Optional: radix tree for Cloudflare CIDR lookups
+try:
+    import pytricia
+except ImportError:
+    pytricia = None
+
+# Optional: Public Suffix List, so example.co.uk maps to example.co.uk, not co.uk
+try:
+    import tldextract
+except ImportError:
+    tldextract = None
+
+# Optional: faster event loop
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 LOG_FILE = Path(__file__).resolve().parent / "dns-verify.log"
+CACHE_DIR = Path(config.VERIFY_DNS_CACHE_DIR).expanduser()
+PROVIDER_CACHE = CACHE_DIR / "providers.json"
+CF_CIDR_CACHE = CACHE_DIR / "cf-cidrs.json"
+
+# Bundled PSL snapshot only (suffix_list_urls=()), so lookups never hit the network
+_EXTRACT = tldextract.TLDExtract(suffix_list_urls=(), cache_dir=str(CACHE_DIR / "tldextract")) if tldextract else None
+
+# One resolver for every query: built once from config (resolv.conf is only read
+# when no DNS_SERVERS are configured) with an answer cache; per-query timeout is
+# passed as lifetime= to resolve().
+_RESOLVER = dns.asyncresolver.Resolver(configure=not config.DNS_SERVERS)
+_RESOLVER.timeout = config.DNS_TIMEOUT
+if config.DNS_SERVERS:
+    _RESOLVER.nameservers = config.DNS_SERVERS
+# dnspython caches positive and negative (NXDOMAIN/NoAnswer) answers for their TTL
+try:
+    _cache_size = int(os.environ.get("DNS_CACHE_SIZE", config.DNS_CACHE_SIZE))
+except ValueError:
+    _cache_size = config.DNS_CACHE_SIZE
+_RESOLVER.cache = dns.resolver.LRUCache(_cache_size)
 
 ANSI = {
     "RED": "\033[0;31m",
@@ -22,121 +76,394 @@ ANSI = {
     "NC": "\033[0m",
 }
 
+_LAST_TS = (0, "")  # (epoch second, formatted string); one tuple so updates are atomic
+
 def _ts():
-    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    global _LAST_TS
+    now = time.time()
+    sec = int(now)
+    if sec != _LAST_TS[0]:
+        _LAST_TS = (sec, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now)))
+    return _LAST_TS[1]
+
+_LOG_FH = None
+
+def _get_log_fh():
+    # Opened once per run; line-buffered so every entry still hits the file.
+    global _LOG_FH
+    if _LOG_FH is None:
+        _LOG_FH = LOG_FILE.open("a", buffering=1)
+        atexit.register(_LOG_FH.close)
+    return _LOG_FH
 
 def log(msg, color="BLUE"):
-    line = f'{ANSI.get(color,"")}[{_ts()}]{ANSI["NC"]} {msg}'
+    ts = _ts()
+    line = f'{ANSI.get(color,"")}[{ts}]{ANSI["NC"]} {msg}'
     print(line)
-    with LOG_FILE.open("a") as f:
-        f.write(f"[{_ts()}] {msg}\n")
+    _get_log_fh().write(f"[{ts}] {msg}\n")
 
 def success(msg): log(f"[SUCCESS] {msg}", "GREEN")
 def warning(msg): log(f"[WARNING] {msg}", "YELLOW")
 def error(msg):   log(f"[ERROR] {msg}", "RED")
 
 def extract_base_domain(domain: str) -> str:
+    if _EXTRACT is not None:
+        ext = _EXTRACT(domain)
+        base = getattr(ext, "top_domain_under_public_suffix", None)
+        if base is None:  # tldextract < 5.3
+            base = ext.registered_domain
+        return base or domain
+    # heuristic without the PSL: last two labels
     parts = domain.strip(".").split(".")
     if len(parts) > 2:
         return ".".join(parts[-2:])
     return domain
 
-def resolve_records(domain: str, rtype: str, nameserver=None):
-    resolver = dns.resolver.Resolver()
-    resolver.timeout = config.DNS_TIMEOUT
-    resolver.lifetime = config.DNS_TIMEOUT
-    if config.DNS_SERVERS:
-        resolver.nameservers = config.DNS_SERVERS
+_SERVER_RESOLVERS = {}
+
+def _resolver_for(nameservers):
+    # Resolvers pinned to specific servers share the main resolver's cache
+    if not nameservers:
+        return _RESOLVER
+    key = tuple(nameservers)
+    resolver = _SERVER_RESOLVERS.get(key)
+    if resolver is None:
+        resolver = dns.asyncresolver.Resolver(configure=False)
+        resolver.nameservers = list(nameservers)
+        resolver.timeout = config.DNS_TIMEOUT
+        resolver.cache = _RESOLVER.cache
+        _SERVER_RESOLVERS[key] = resolver
+    return resolver
+
+async def aresolve(domain: str, rtype: str, nameservers=None):
     try:
-        answers = resolver.resolve(domain, rtype)
+        answers = await _resolver_for(nameservers).resolve(domain, rtype, lifetime=config.DNS_TIMEOUT)
         return [r.to_text().rstrip(".") for r in answers]
     except Exception:
         return []
 
-def identify_dns_provider(domain: str) -> str:
+async def aresolve_fastest(domain: str, rtype: str):
+    # Ask every configured server at once and keep the first non-empty answer,
+    # so a slow or dead server costs nothing as long as another one replies.
+    if len(config.DNS_SERVERS) < 2:
+        return await aresolve(domain, rtype)
+    pending = {asyncio.ensure_future(aresolve(domain, rtype, nameservers=[srv]))
+               for srv in config.DNS_SERVERS}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                records = task.result()
+                if records:
+                    return records
+        return []
+    finally:
+        for task in pending:
+            task.cancel()
+
+def _skip_name(buf: bytes, off: int) -> int:
+    while True:
+        n = buf[off]
+        if n == 0:
+            return off + 1
+        if n & 0xC0 == 0xC0:
+            return off + 2
+        off += n + 1
+
+def _read_name(buf: bytes, off: int) -> str:
+    labels, jumps = [], 0
+    while True:
+        n = buf[off]
+        if n & 0xC0 == 0xC0:
+            jumps += 1
+            if jumps > 16:
+                raise ValueError("compression pointer loop")
+            off = ((n & 0x3F) << 8) | buf[off + 1]
+            continue
+        if n == 0:
+            return ".".join(labels)
+        labels.append(buf[off + 1:off + 1 + n].decode("ascii"))
+        off += n + 1
+
+def _parse_a_response(buf: bytes, query_id: int):
+    # Header, skip the question, then pick A (4-byte IPv4) and CNAME RDATA
+    # out of the answer section. None means "let dnspython handle it".
+    qid, flags, qdcount, ancount = struct.unpack_from("!HHHH", buf)
+    if qid != query_id or not flags & 0x8000 or flags & 0x0200:
+        return None  # not our response, or truncated (TC)
+    if flags & 0x000F not in (0, 3):
+        return None  # only NOERROR / NXDOMAIN are handled here
+    off = 12
+    for _ in range(qdcount):
+        off = _skip_name(buf, off) + 4
+    ips, cnames = [], []
+    for _ in range(ancount):
+        off = _skip_name(buf, off)
+        rtype, _, _, rdlen = struct.unpack_from("!HHIH", buf, off)
+        off += 10
+        if rtype == 1 and rdlen == 4:
+            ips.append(socket.inet_ntoa(buf[off:off + 4]))
+        elif rtype == 5:
+            cnames.append(_read_name(buf, off))
+        off += rdlen
+    return ips, cnames
+
+async def _udp_query_a(domain: str):
+    # One datagram straight to the first configured server, skipping the
+    # dnspython resolver machinery; any surprise returns None.
+    if not config.DNS_FAST_PATH or not config.DNS_SERVERS:
+        return None
+    server = config.DNS_SERVERS[0]
+    try:
+        query = dns.message.make_query(domain, "A")
+    except dns.exception.DNSException:
+        return None
+    loop = asyncio.get_running_loop()
+    family = socket.AF_INET6 if ":" in server else socket.AF_INET
+    with socket.socket(family, socket.SOCK_DGRAM) as sock:
+        sock.setblocking(False)
+        try:
+            sock.connect((server, 53))
+            await loop.sock_sendall(sock, query.to_wire())
+            reply = await asyncio.wait_for(loop.sock_recv(sock, 4096), config.DNS_SERVER_TIMEOUT)
+            return _parse_a_response(reply, query.id)
+        except Exception:
+            return None
+
+async def aresolve_a_chain(domain: str):
+    """
+    A records and the CNAME targets that led to them, from a single A query.
+    Returns None when no usable response came back (timeout, SERVFAIL, ...).
+    """
+    fast = await _udp_query_a(domain)
+    if fast is not None:
+        return fast
+    try:
+        answer = await _RESOLVER.resolve(domain, "A", lifetime=config.DNS_TIMEOUT)
+        response = answer.response
+    except dns.resolver.NoAnswer as e:
+        response = e.response()
+    except dns.resolver.NXDOMAIN as e:
+        response = e.response(e.qnames()[0])
+    except Exception:
+        return None
+    try:
+        chain = response.resolve_chaining()
+    except Exception:
+        return None
+    cnames = [rr.target.to_text().rstrip(".") for rrset in chain.cnames for rr in rrset]
+    ips = [rr.to_text() for rr in chain.answer] if chain.answer else []
+    return ips, cnames
+
+# NS hostname fragment -> provider, checked in order (first match wins)
+_PROVIDER_MAP = (
+    ("awsdns", "Route 53"),
+    ("cloudflare", "Cloudflare"),
+    ("godaddy", "GoDaddy"),
+    ("dns.google", "Google Cloud DNS"),
+    ("dnsmadeeasy", "DNS Made Easy"),
+    ("registrar-servers", "Namecheap"),
+    ("networksolutions", "Network Solutions"),
+    ("azure-dns", "Microsoft Azure DNS"),
+    ("ns.digitalocean", "DigitalOcean"),
+    ("ns1", "NS1"),
+    ("ultradns", "UltraDNS"),
+    ("yahoo", "Yahoo Small Business"),
+    ("akamai", "Akamai"),
+    ("rackspace", "Rackspace Cloud DNS"),
+    ("oraclecloud", "Oracle Cloud DNS"),
+)
+
+def _cached_provider(base: str):
+    try:
+        with PROVIDER_CACHE.open() as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            provider, expiry = json.load(f)[base]
+    except Exception:
+        return None
+    return provider if expiry > time.time() else None
+
+def _store_provider(base: str, provider: str):
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        with PROVIDER_CACHE.open("a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                data = json.load(f)
+            except ValueError:
+                data = {}
+            data[base] = (provider, time.time() + config.DNS_PROVIDER_CACHE_TTL)
+            f.seek(0)
+            f.truncate()
+            json.dump(data, f)
+    except Exception:
+        pass
+
+async def identify_dns_provider(domain: str) -> str:
     base = extract_base_domain(domain)
     log(f"Identifying DNS provider for base domain: {base}")
-    ns_records = []
-    # try across our configured servers by reconfiguring resolver
-    for _ in range(max(1, len(config.DNS_SERVERS))):
-        ns_records = resolve_records(base, "NS")
-        if ns_records:
-            break
-    for ns in [n.lower() for n in ns_records]:
-        if "awsdns" in ns: return "Route 53"
-        if "cloudflare" in ns: return "Cloudflare"
-        if "godaddy" in ns: return "GoDaddy"
-        if "dns.google" in ns: return "Google Cloud DNS"
-        if "dnsmadeeasy" in ns: return "DNS Made Easy"
-        if "registrar-servers" in ns: return "Namecheap"
-        if "networksolutions" in ns: return "Network Solutions"
-        if "azure-dns" in ns: return "Microsoft Azure DNS"
-        if "ns.digitalocean" in ns: return "DigitalOcean"
-        if "ns1" in ns: return "NS1"
-        if "ultradns" in ns: return "UltraDNS"
-        if "yahoo" in ns: return "Yahoo Small Business"
-        if "akamai" in ns: return "Akamai"
-        if "rackspace" in ns: return "Rackspace Cloud DNS"
-        if "oraclecloud" in ns: return "Oracle Cloud DNS"
+    # NS delegations change rarely; reuse a recent answer from an earlier run
+    provider = _cached_provider(base)
+    if provider:
+        log(f"Using cached DNS provider for {base}")
+        return provider
+    provider = await _lookup_dns_provider(base)
+    if provider != "Unknown provider":
+        _store_provider(base, provider)
+    return provider
+
+async def _lookup_dns_provider(base: str) -> str:
+    ns_records = await aresolve_fastest(base, "NS")
+    for ns in ns_records:
+        ns = ns.lower()
+        for needle, provider in _PROVIDER_MAP:
+            if needle in ns:
+                return provider
     return "Unknown provider"
 
+# Used when the Cloudflare API can't be reached (callers must not mutate it)
+_CF_CIDR_FALLBACK_V4 = [
+    "173.245.48.0/20","103.21.244.0/22","103.22.200.0/22","103.31.4.0/22",
+    "141.101.64.0/18","108.162.192.0/18","190.93.240.0/20","188.114.96.0/20",
+    "197.234.240.0/22","198.41.128.0/17","162.158.0.0/15","104.16.0.0/13",
+    "104.24.0.0/14","172.64.0.0/13","131.0.72.0/22",
+]
+
+def _cached_cloudflare_cidrs():
+    try:
+        if time.time() - CF_CIDR_CACHE.stat().st_mtime > config.CLOUDFLARE_CIDR_CACHE_TTL:
+            return None
+        with CF_CIDR_CACHE.open() as f:
+            data = json.load(f)
+        return data["ipv4_cidrs"], data["ipv6_cidrs"]
+    except Exception:
+        return None
+
+def _store_cloudflare_cidrs(v4, v6):
+    # write-then-rename so concurrent runs never read a partial file
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = CF_CIDR_CACHE.with_name(f"{CF_CIDR_CACHE.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps({"ipv4_cidrs": v4, "ipv6_cidrs": v6}))
+        os.replace(tmp, CF_CIDR_CACHE)
+    except Exception:
+        pass
+
 def fetch_cloudflare_cidrs():
+    cached = _cached_cloudflare_cidrs()
+    if cached:
+        log("Using cached Cloudflare IP ranges")
+        return cached
     log("Fetching Cloudflare IP ranges...")
     try:
         with urllib.request.urlopen("https://api.cloudflare.com/client/v4/ips", timeout=10) as r:
-            data = json.loads(r.read().decode("utf-8"))
-            v4 = data.get("result",{}).get("ipv4_cidrs",[]) or []
-            v6 = data.get("result",{}).get("ipv6_cidrs",[]) or []
+            # a response without these keys is treated like a failed fetch
+            body = r.read()
+            data = (orjson.loads(body) if orjson else json.loads(body))["result"]
+            v4, v6 = data["ipv4_cidrs"], data["ipv6_cidrs"]
+            if v4:
+                _store_cloudflare_cidrs(v4, v6)
             return v4, v6
     except Exception:
         warning("Failed to fetch Cloudflare IP ranges, using a minimal fallback")
-        return ([
-            "173.245.48.0/20","103.21.244.0/22","103.22.200.0/22","103.31.4.0/22",
-            "141.101.64.0/18","108.162.192.0/18","190.93.240.0/20","188.114.96.0/20",
-            "197.234.240.0/22","198.41.128.0/17","162.158.0.0/15","104.16.0.0/13",
-            "104.24.0.0/14","172.64.0.0/13","131.0.72.0/22"
-        ], [])
-
-def ip_in_any_cidr(ip: str, cidrs):
-    ip_obj = ipaddress.ip_address(ip)
+        return _CF_CIDR_FALLBACK_V4, []
+
+def _parse_networks(cidrs, network_cls):
+    nets = []
     for c in cidrs:
         try:
-            if ip_obj in ipaddress.ip_network(c):
-                return True
-        except Exception:
+            nets.append(network_cls(c))
+        except ValueError:
             pass
-    return False
+    # drops duplicates and merges overlapping/adjacent ranges
+    return list(ipaddress.collapse_addresses(nets))
+
+def _family_matcher(nets, bits):
+    if pytricia is None:
+        return nets
+    tree = pytricia.PyTricia(bits)
+    for net in nets:
+        tree.insert(str(net), True)
+    return tree
+
+def build_cidr_matcher(cf4, cf6):
+    # Parse the CIDR lists once, one structure per address family: a PyTricia
+    # radix tree when available, else a list of ip_network objects.
+    return (_family_matcher(_parse_networks(cf4, ipaddress.IPv4Network), 32),
+            _family_matcher(_parse_networks(cf6, ipaddress.IPv6Network), 128))
 
-def check_cloudflare_proxy(domain: str, cf4, cf6):
+def ip_in_any_cidr(ip: str, matcher):
+    ip_obj = ipaddress.ip_address(ip)
+    nets = matcher[1] if ip_obj.version == 6 else matcher[0]
+    if pytricia is not None and isinstance(nets, pytricia.PyTricia):
+        return ip_obj in nets
+    return any(ip_obj in net for net in nets)
+
+async def check_cloudflare_proxy(domain: str, cf_nets):
     log(f"Checking Cloudflare proxy for {domain}...")
-    a_records = resolve_records(domain, "A")
+    a_records = await aresolve(domain, "A")
     if not a_records:
         return False
     for ip in a_records:
-        if ip_in_any_cidr(ip, cf4):
+        if ip_in_any_cidr(ip, cf_nets):
             log(f"{domain} resolves to {ip} which is in Cloudflare range")
             return True
     return False
 
-def verify_domain_a_records(domain: str, expected_ips):
+async def chase_cname(targets, max_depth=5):
+    # Resolve A records at the end of a CNAME chain ourselves, for when the
+    # resolver didn't return them with the alias (e.g. SERVFAIL on the A query).
+    # Bounded so a CNAME loop can't keep us here.
+    resolved, seen = [], set()
+    for _ in range(max_depth):
+        targets = [t for t in targets if t not in seen]
+        if not targets:
+            break
+        seen.update(targets)
+        answers = await asyncio.gather(*[asyncio.gather(aresolve(t, "A"), aresolve(t, "CNAME")) for t in targets])
+        next_targets = []
+        for a_records, cnames in answers:
+            resolved += a_records
+            if not a_records:
+                next_targets += cnames
+        if resolved:
+            break
+        targets = next_targets
+    return resolved
+
+async def verify_domain_a_records(domain: str, expected_ips):
     log(f"Verifying A records for domain: {domain}")
     if not expected_ips:
         error("No expected IPs provided for verification")
         return False
+    expected_set = frozenset(expected_ips)
 
     retries = max(1, int(config.DNS_RETRIES))
+    budget = config.DNS_TIMEOUT * retries
+    deadline = time.monotonic() + budget
     for attempt in range(retries):
         if attempt:
-            delay = 2 ** attempt
-            log(f"Retry {attempt} with {delay}s delay")
-            try:
-                import time; time.sleep(delay)
-            except Exception:
-                pass
+            # jittered so parallel CI runs don't retry against the resolver in lockstep
+            delay = min(30, 2 ** attempt) * (0.5 + random.random())
+            if time.monotonic() + delay > deadline:
+                warning(f"Giving up on {domain}: {budget}s retry budget exhausted")
+                return False
+            log(f"Retry {attempt} with {delay:.1f}s delay")
+            await asyncio.sleep(delay)
 
-        resolved = resolve_records(domain, "A")
+        # the A response already carries any CNAME chain; only ask for the
+        # CNAME separately when the A query produced no usable response
+        chained = await aresolve_a_chain(domain)
+        if chained is None:
+            resolved, cname = [], await aresolve_fastest(domain, "CNAME")
+        else:
+            resolved, cname = chained
+        if not resolved and cname:
+            resolved = await chase_cname(cname)
+            if resolved:
+                log(f"Resolved A records via CNAME target: {', '.join(cname)}")
         if not resolved:
-            cname = resolve_records(domain, "CNAME")
             if cname:
                 log(f"Domain has CNAME record: {', '.join(cname)}")
                 if attempt == retries-1:
@@ -147,8 +474,9 @@ def verify_domain_a_records(domain: str, expected_ips):
                 return False
             continue
 
-        log(f"Resolved IPs: {' '.join(resolved)}")
-        if any(ip in resolved for ip in expected_ips):
+        if config.DEBUG_MODE:
+            log(f"Resolved IPs: {' '.join(resolved)}")
+        if not expected_set.isdisjoint(resolved):
             success("DNS verification successful: domain points to expected IPs")
             return True
 
@@ -157,7 +485,7 @@ def verify_domain_a_records(domain: str, expected_ips):
             return False
     return False
 
-def main():
+async def main_async():
     parser = argparse.ArgumentParser(
         description="DNS Verification (Pythonic)",
         formatter_class=argparse.RawTextHelpFormatter
@@ -170,12 +498,13 @@ def main():
     expected_ips = args.expected_ips
 
     log(f"Starting DNS verification for domain: {domain}")
-    provider = identify_dns_provider(domain)
+    provider = await identify_dns_provider(domain)
     log(f"DNS provider identified: {provider}")
 
-    cf4, cf6 = fetch_cloudflare_cidrs()
     if provider == "Cloudflare":
-        if check_cloudflare_proxy(domain, cf4, cf6):
+        cf4, cf6 = fetch_cloudflare_cidrs()
+        cf_nets = build_cidr_matcher(cf4, cf6)
+        if await check_cloudflare_proxy(domain, cf_nets):
             warning(f"Domain {domain} is using Cloudflare proxy")
             print(json.dumps({
                 "message": "Please disable the proxy in Cloudflare to match SSL certificate",
@@ -185,7 +514,7 @@ def main():
             sys.exit(0)
         else:
             log("Cloudflare proxy is disabled; checking A records...")
-            matched = verify_domain_a_records(domain, expected_ips)
+            matched = await verify_domain_a_records(domain, expected_ips)
             print(json.dumps({
                 "message": "matched" if matched else "not matched",
                 "dnsProvider": provider,
@@ -193,12 +522,17 @@ def main():
             }))
             sys.exit(0 if matched else 1)
 
-    matched = verify_domain_a_records(domain, expected_ips)
+    matched = await verify_domain_a_records(domain, expected_ips)
     print(json.dumps({
         "message": "matched" if matched else "not matched",
         "dnsProvider": provider
     }))
     sys.exit(0 if matched else 1)
 
+def main():
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    asyncio.run(main_async())
+
 if __name__ == "__main__":
     main()